@@ -19,6 +19,9 @@ UNET_PATH = os.path.join(ONNX_MODELS_DIR, "unet", "model_opt.onnx")
 CLIP_TEXT_ENCODER_1_PATH = os.path.join(ONNX_MODELS_DIR, "text_encoder", "model_opt.onnx")
 CLIP_TEXT_ENCODER_2_PATH = os.path.join(ONNX_MODELS_DIR, "text_encoder_2", "model_opt.onnx")
 
+# ONNX Runtime TensorRT EP engine cache
+TRT_ENGINE_CACHE_DIR = "/workflow/trt_cache"
+
 # Tagger
 WD14_TAGGER_DIR = os.path.join(_project_root, "wd14-tagger-v3-onnx")
 WD14_TAGGER_MODEL_PATH = os.path.join(WD14_TAGGER_DIR, "model.onnx")
@@ -1,6 +1,6 @@
 from diffusers import EulerAncestralDiscreteScheduler, AutoencoderTiny
 from diffusers.image_processor import VaeImageProcessor
-from transformers import CLIPTokenizer, CLIPTextModel, CLIPTextModelWithProjection
+from transformers import CLIPTokenizerFast, CLIPTextModel, CLIPTextModelWithProjection
 import torch
 
 import models
@@ -15,10 +15,10 @@ def load_pipeline_components():
     Load all the components of the SDXL pipeline.
     """
     device = torch.device("cuda:0")
-    tokenizer_1 = CLIPTokenizer.from_pretrained(
+    tokenizer_1 = CLIPTokenizerFast.from_pretrained(
         defaults.DEFAULT_BASE_MODEL, subfolder="tokenizer"
     )
-    tokenizer_2 = CLIPTokenizer.from_pretrained(
+    tokenizer_2 = CLIPTokenizerFast.from_pretrained(
         defaults.DEFAULT_BASE_MODEL, subfolder="tokenizer_2"
     )
 
@@ -2,10 +2,16 @@ import onnxruntime as ort
 import numpy as np
 import torch
 from dataclasses import dataclass
+from collections import OrderedDict
 from typing import Optional, Tuple
 import os
 from transformers import CLIPTextModel, CLIPTextModelWithProjection
 
+import defaults
+
+# Debug prints run full-tensor reductions and force device syncs; keep them off the hot path
+_DEBUG = os.environ.get("PIPELINE_DEBUG") == "1"
+
 
 @dataclass
 class ONNXCLIPTextOutput:
@@ -15,20 +21,74 @@ class ONNXCLIPTextOutput:
     text_embeds: Optional[torch.Tensor] = None
 
 class ONNXModel:
-    def __init__(self, model_path: str, device: torch.device):
+    _np_dtype = {
+        torch.float16: np.float16,
+        torch.float32: np.float32,
+        torch.int64: np.int64,
+        torch.int32: np.int32,
+        torch.uint8: np.uint8,
+    }
+
+    def __init__(self, model_path: str, device: torch.device, providers: Optional[list] = None):
         self.device = device
         subfolder = os.path.basename(os.path.dirname(model_path))
         filename = os.path.basename(model_path)
         print(f"\\n--- Creating InferenceSession for: {subfolder}/{filename} ---")
-        #so = ort.SessionOptions()
+        so = ort.SessionOptions()
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
         #so.log_severity_level = 1
-        provider_options = [{"device_id": self.device.index}]
+        if providers is None:
+            # TensorRT with FP16 kernels first, falling back to CUDA for unsupported nodes
+            providers = [
+                ("TensorrtExecutionProvider", {
+                    "device_id": self.device.index,
+                    "trt_fp16_enable": True,
+                    "trt_engine_cache_enable": True,
+                    "trt_engine_cache_path": defaults.TRT_ENGINE_CACHE_DIR,
+                }),
+                ("CUDAExecutionProvider", {"device_id": self.device.index}),
+            ]
         self.session = ort.InferenceSession(
-            model_path, providers=[("CUDAExecutionProvider")]
+            model_path, sess_options=so, providers=providers
         )
         self.io_binding = self.session.io_binding()
         self.input_names = [i.name for i in self.session.get_inputs()]
         self.output_names = [o.name for o in self.session.get_outputs()]
+        # Persistent output buffers keyed by (shape, dtype), reused across calls
+        self._out_cache = {}
+        # Tensors currently bound per name; holding them keeps the bound pointers valid
+        self._bound_inputs = {}
+        self._bound_outputs = {}
+
+    def output_buffer(self, shape: tuple, dtype: torch.dtype) -> torch.Tensor:
+        key = (tuple(shape), dtype)
+        tensor = self._out_cache.get(key)
+        if tensor is None:
+            tensor = torch.empty(shape, dtype=dtype, device=self.device)
+            self._out_cache[key] = tensor
+        return tensor
+
+    @staticmethod
+    def _is_bound(bound: dict, name: str, tensor: torch.Tensor) -> bool:
+        current = bound.get(name)
+        return (
+            current is not None
+            and current.data_ptr() == tensor.data_ptr()
+            and current.shape == tensor.shape
+            and current.dtype == tensor.dtype
+        )
+
+    def bind_io(self, inputs: dict, outputs: dict):
+        # Only names whose tensor changed are rebound; ORT replaces an existing binding of the same name
+        for name, tensor in inputs.items():
+            tensor = tensor.contiguous()
+            if not self._is_bound(self._bound_inputs, name, tensor):
+                self.bind_input(name, tensor)
+                self._bound_inputs[name] = tensor
+        for name, tensor in outputs.items():
+            if not self._is_bound(self._bound_outputs, name, tensor):
+                self.bind_output(name, tensor)
+                self._bound_outputs[name] = tensor
 
     def bind_input(self, name: str, tensor: torch.Tensor):
         tensor = tensor.contiguous()
@@ -36,7 +96,7 @@ class ONNXModel:
             name=name,
             device_type='cuda',
             device_id=self.device.index,
-            element_type=np.float16 if tensor.dtype == torch.float16 else np.float32 if tensor.dtype == torch.float32 else np.int64,
+            element_type=self._np_dtype[tensor.dtype],
             shape=tensor.shape,
             buffer_ptr=tensor.data_ptr(),
         )
@@ -47,7 +107,7 @@ class ONNXModel:
             name=name,
             device_type='cuda',
             device_id=self.device.index,
-            element_type=np.float16 if tensor.dtype == torch.float16 else np.float32 if tensor.dtype == torch.float32 else np.int64,
+            element_type=self._np_dtype[tensor.dtype],
             shape=tensor.shape,
             buffer_ptr=tensor.data_ptr(),
         )
@@ -57,20 +117,17 @@ class VAEDecoder(ONNXModel):
         super().__init__(model_path, device)
 
     def __call__(self, latent: torch.Tensor) -> torch.Tensor:
-        self.io_binding.clear_binding_inputs()
-        self.io_binding.clear_binding_outputs()
-        
-        print("--- VAEDecoder Input ---")
-        print(f"latent: shape={latent.shape}, dtype={latent.dtype}, device={latent.device}")
-        print(f"latent | Mean: {latent.mean():.6f} | Std: {latent.std():.6f} | Sum: {latent.sum():.6f}")
-        print("------------------------")
+        if _DEBUG:
+            print("--- VAEDecoder Input ---")
+            print(f"latent: shape={latent.shape}, dtype={latent.dtype}, device={latent.device}")
+            print(f"latent | Mean: {latent.mean():.6f} | Std: {latent.std():.6f} | Sum: {latent.sum():.6f}")
+            print("------------------------")
 
-        self.bind_input("latent_sample", latent.to(torch.float16))
-        
         output_shape = (latent.shape[0], 3, latent.shape[2] * 8, latent.shape[3] * 8)
-        output_tensor = torch.empty(output_shape, dtype=torch.float16, device=self.device)
-        self.bind_output("sample", output_tensor)
-        
+        # The returned buffer is overwritten by the next call of the same shape
+        output_tensor = self.output_buffer(output_shape, torch.float16)
+        self.bind_io({"latent_sample": latent.to(torch.float16)}, {"sample": output_tensor})
+
         self.session.run_with_iobinding(self.io_binding)
         return output_tensor
 
@@ -79,37 +136,46 @@ class UNet(ONNXModel):
     def __init__(self, model_path: str, device: torch.device):
         super().__init__(model_path, device)
 
-    def __call__(self, latent: torch.Tensor, timestep: torch.Tensor, text_embedding: torch.Tensor, text_embeds: torch.Tensor, time_ids: torch.Tensor) -> torch.Tensor:
-        self.io_binding.clear_binding_inputs()
-        self.io_binding.clear_binding_outputs()
-
-        latent = latent.to(torch.float16)
-        timestep = timestep.to(torch.float16)
+    def set_static_inputs(self, text_embedding: torch.Tensor, text_embeds: torch.Tensor, time_ids: torch.Tensor):
+        """Bind the per-generation conditioning once; each step then only rebinds sample and timestep."""
         text_embedding = text_embedding.to(torch.float16)
         text_embeds = text_embeds.to(torch.float16)
         time_ids = time_ids.to(torch.float16)
 
-        print("--- UNet Inputs ---")
-        print(f"latent: shape={latent.shape}, dtype={latent.dtype}, device={latent.device}")
-        print(f"latent | Mean: {latent.mean():.6f} | Std: {latent.std():.6f} | Sum: {latent.sum():.6f}")
-        print(f"timestep: shape={timestep.shape}, dtype={timestep.dtype}, device={timestep.device}, value: {timestep.item()}")
-        print(f"text_embedding: shape={text_embedding.shape}, dtype={text_embedding.dtype}, device={text_embedding.device}")
-        print(f"text_embedding | Mean: {text_embedding.mean():.6f} | Std: {text_embedding.std():.6f} | Sum: {text_embedding.sum():.6f}")
-        print(f"text_embeds: shape={text_embeds.shape}, dtype={text_embeds.dtype}, device={text_embeds.device}")
-        print(f"text_embeds | Mean: {text_embeds.mean():.6f} | Std: {text_embeds.std():.6f} | Sum: {text_embeds.sum():.6f}")
-        print(f"time_ids: shape={time_ids.shape}, dtype={time_ids.dtype}, device={time_ids.device}")
-        print(f"time_ids | Mean: {time_ids.mean():.6f} | Std: {time_ids.std():.6f} | Sum: {time_ids.sum():.6f}")
-        print("--------------------")
-
-        self.bind_input("sample", latent)
-        self.bind_input("timestep", timestep)
-        self.bind_input("encoder_hidden_states", text_embedding)
-        self.bind_input("text_embeds", text_embeds)
-        self.bind_input("time_ids", time_ids)
-
-        output_tensor = torch.empty(latent.shape, dtype=latent.dtype, device=self.device)
-        self.bind_output("out_sample", output_tensor)
-        
+        if _DEBUG:
+            print("--- UNet Static Inputs ---")
+            print(f"text_embedding: shape={text_embedding.shape}, dtype={text_embedding.dtype}, device={text_embedding.device}")
+            print(f"text_embedding | Mean: {text_embedding.mean():.6f} | Std: {text_embedding.std():.6f} | Sum: {text_embedding.sum():.6f}")
+            print(f"text_embeds: shape={text_embeds.shape}, dtype={text_embeds.dtype}, device={text_embeds.device}")
+            print(f"text_embeds | Mean: {text_embeds.mean():.6f} | Std: {text_embeds.std():.6f} | Sum: {text_embeds.sum():.6f}")
+            print(f"time_ids: shape={time_ids.shape}, dtype={time_ids.dtype}, device={time_ids.device}")
+            print(f"time_ids | Mean: {time_ids.mean():.6f} | Std: {time_ids.std():.6f} | Sum: {time_ids.sum():.6f}")
+            print("--------------------------")
+
+        self.bind_io(
+            {
+                "encoder_hidden_states": text_embedding,
+                "text_embeds": text_embeds,
+                "time_ids": time_ids,
+            },
+            {},
+        )
+
+    def __call__(self, latent: torch.Tensor, timestep: torch.Tensor) -> torch.Tensor:
+        latent = latent.to(torch.float16)
+        timestep = timestep.to(torch.float16)
+
+        if _DEBUG:
+            print("--- UNet Inputs ---")
+            print(f"latent: shape={latent.shape}, dtype={latent.dtype}, device={latent.device}")
+            print(f"latent | Mean: {latent.mean():.6f} | Std: {latent.std():.6f} | Sum: {latent.sum():.6f}")
+            print(f"timestep: shape={timestep.shape}, dtype={timestep.dtype}, device={timestep.device}, value: {timestep.item()}")
+            print("--------------------")
+
+        # The returned buffer is overwritten by the next step
+        output_tensor = self.output_buffer(latent.shape, latent.dtype)
+        self.bind_io({"sample": latent, "timestep": timestep}, {"out_sample": output_tensor})
+
         self.session.run_with_iobinding(self.io_binding)
         return output_tensor
 
@@ -136,6 +202,10 @@ class CLIPTextEncoder(ONNXModel):
             elif self.pooler_output_name and output.name == self.pooler_output_name:
                 self.pooler_dim = output.shape[-1]
 
+        # LRU cache of (last_hidden_state, pooler_output) keyed by the token ids
+        self._cache = OrderedDict()
+        self._cache_max = 32
+
     def __call__(
         self,
         input_ids: torch.Tensor,
@@ -143,67 +213,93 @@ class CLIPTextEncoder(ONNXModel):
         output_hidden_states: Optional[bool] = None,
         return_dict: Optional[bool] = None,
     ):
-        self.io_binding.clear_binding_inputs()
-        self.io_binding.clear_binding_outputs()
-
         input_ids = input_ids.to(torch.int64)
 
-        print(f"--- {self.name} ONNX Input ---")
-        print(f"input_ids: shape={input_ids.shape}, dtype={input_ids.dtype}, device={input_ids.device}")
-        print(f"tokens: {input_ids.flatten().tolist()}")
-        if attention_mask is not None:
-            print(f"attention_mask: shape={attention_mask.shape}, dtype={attention_mask.dtype}, device={attention_mask.device}")
-        if output_hidden_states is not None:
-            print(f"output_hidden_states: {output_hidden_states}")
-        print("---------------------------")
+        if _DEBUG:
+            print(f"--- {self.name} ONNX Input ---")
+            print(f"input_ids: shape={input_ids.shape}, dtype={input_ids.dtype}, device={input_ids.device}")
+            print(f"tokens: {input_ids.flatten().tolist()}")
+            if attention_mask is not None:
+                print(f"attention_mask: shape={attention_mask.shape}, dtype={attention_mask.dtype}, device={attention_mask.device}")
+            if output_hidden_states is not None:
+                print(f"output_hidden_states: {output_hidden_states}")
+            print("---------------------------")
+
+        # Repeated prompts skip the ONNX run; cached tensors are shared, so callers must not modify them in place.
+        # Pass host ids straight from the tokenizer: the key is built without a device->host copy and the ids
+        # are only moved to the device on a miss
+        key = (tuple(input_ids.shape), input_ids.cpu().numpy().tobytes())
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            last_hidden_state, pooler_output = cached
+        else:
+            last_hidden_state, pooler_output = self._encode(input_ids.to(self.device))
+            self._cache[key] = (last_hidden_state, pooler_output)
+            if len(self._cache) > self._cache_max:
+                self._cache.popitem(last=False)
+
+        hidden_states = None
+        if output_hidden_states:
+            hidden_states = (last_hidden_state,)
+
+        return ONNXCLIPTextOutput(
+            last_hidden_state=last_hidden_state,
+            pooler_output=pooler_output,
+            hidden_states=hidden_states,
+            text_embeds=pooler_output,
+        )
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def _encode(self, input_ids: torch.Tensor) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        self.io_binding.clear_binding_inputs()
+        self.io_binding.clear_binding_outputs()
 
         self.bind_input("input_ids", input_ids)
 
         # Prepare output tensors
         batch_size, seq_len = input_ids.shape
         
-        print(f"--- {self.name} Prepared Output Shapes ---")
         last_hidden_state_shape = (batch_size, seq_len, self.hidden_size)
-        print(f"last_hidden_state_shape: {last_hidden_state_shape}")
         last_hidden_state = torch.empty(last_hidden_state_shape, dtype=torch.float16, device=self.device)
         self.bind_output(self.last_hidden_state_name, last_hidden_state)
         
         pooler_output = None
         if self.name == "CLIP-G":
             pooler_output_shape = (batch_size, self.pooler_dim)
-            print(f"pooler_output_shape: {pooler_output_shape}")
             pooler_output = torch.empty(pooler_output_shape, dtype=torch.float16, device=self.device)
             self.bind_output(self.pooler_output_name, pooler_output)
-        print("------------------------------------")
+
+        if _DEBUG:
+            print(f"--- {self.name} Prepared Output Shapes ---")
+            print(f"last_hidden_state_shape: {last_hidden_state_shape}")
+            if pooler_output is not None:
+                print(f"pooler_output_shape: {pooler_output_shape}")
+            print("------------------------------------")
 
         self.session.run_with_iobinding(self.io_binding)
 
-        print(f"--- {self.name} ONNX Output ---")
-        
-        last_hidden_state_nan_count = torch.isnan(last_hidden_state).sum()
-        pooler_output_nan_count = torch.isnan(pooler_output).sum() if pooler_output is not None else 0
-        
-        print(f"{self.last_hidden_state_name}: shape={last_hidden_state.shape}, dtype={last_hidden_state.dtype}, device={last_hidden_state.device}, nans={last_hidden_state_nan_count}/{last_hidden_state.numel()}")
-        print(f"{self.last_hidden_state_name} | Mean: {last_hidden_state.mean():.6f} | Std: {last_hidden_state.std():.6f} | Sum: {last_hidden_state.sum():.6f}")
-        if pooler_output is not None:
-            print(f"{self.pooler_output_name}: shape={pooler_output.shape}, dtype={pooler_output.dtype}, device={pooler_output.device}, nans={pooler_output_nan_count}/{pooler_output.numel()}")
-            print(f"{self.pooler_output_name} | Mean: {pooler_output.mean():.6f} | Std: {pooler_output.std():.6f} | Sum: {pooler_output.sum():.6f}")
-        print("----------------------------")
+        if _DEBUG:
+            print(f"--- {self.name} ONNX Output ---")
+            
+            last_hidden_state_nan_count = torch.isnan(last_hidden_state).sum()
+            pooler_output_nan_count = torch.isnan(pooler_output).sum() if pooler_output is not None else 0
+            
+            print(f"{self.last_hidden_state_name}: shape={last_hidden_state.shape}, dtype={last_hidden_state.dtype}, device={last_hidden_state.device}, nans={last_hidden_state_nan_count}/{last_hidden_state.numel()}")
+            print(f"{self.last_hidden_state_name} | Mean: {last_hidden_state.mean():.6f} | Std: {last_hidden_state.std():.6f} | Sum: {last_hidden_state.sum():.6f}")
+            if pooler_output is not None:
+                print(f"{self.pooler_output_name}: shape={pooler_output.shape}, dtype={pooler_output.dtype}, device={pooler_output.device}, nans={pooler_output_nan_count}/{pooler_output.numel()}")
+                print(f"{self.pooler_output_name} | Mean: {pooler_output.mean():.6f} | Std: {pooler_output.std():.6f} | Sum: {pooler_output.sum():.6f}")
+            print("----------------------------")
 
-        hidden_states = None
-        if output_hidden_states:
-            hidden_states = (last_hidden_state,)
-
-        return ONNXCLIPTextOutput(
-            last_hidden_state=last_hidden_state,
-            pooler_output=pooler_output,
-            hidden_states=hidden_states,
-            text_embeds=pooler_output,
-        )
+        return last_hidden_state, pooler_output
 
 class WDTaggerONNX(ONNXModel):
     def __init__(self, model_path: str, device: torch.device):
-        super().__init__(model_path, device)
+        # The NSFW filter thresholds its scores; stay on the CUDA EP so they match the original FP32 model
+        super().__init__(model_path, device, providers=[("CUDAExecutionProvider", {"device_id": device.index})])
         self.input_shape = self.session.get_inputs()[0].shape
         self.image_size = self.input_shape[2]
 
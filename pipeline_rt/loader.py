@@ -1,6 +1,6 @@
 from diffusers import EulerAncestralDiscreteScheduler, AutoencoderKL
 from diffusers.image_processor import VaeImageProcessor
-from transformers import CLIPTokenizer
+from transformers import CLIPTokenizerFast
 import torch
 import os
 import json
@@ -15,10 +15,10 @@ def load_pipeline_components():
     device = torch.device("cuda:0")
     
     # Tokenizers
-    tokenizer_1 = CLIPTokenizer.from_pretrained(
+    tokenizer_1 = CLIPTokenizerFast.from_pretrained(
         defaults.DEFAULT_BASE_MODEL, subfolder="tokenizer"
     )
-    tokenizer_2 = CLIPTokenizer.from_pretrained(
+    tokenizer_2 = CLIPTokenizerFast.from_pretrained(
         defaults.DEFAULT_BASE_MODEL, subfolder="tokenizer_2"
     )
 
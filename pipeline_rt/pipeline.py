@@ -28,6 +28,16 @@ class SDXLPipeline:
 
         self.image_processor = self.components["image_processor"]
         self.vae_scale_factor = self.components["vae_scale_factor"]
+        self._host_buffer = None
+
+    def _to_pil(self, image: torch.Tensor) -> Image.Image:
+        # Stage the HWC uint8 image through a reused pinned buffer; Image.fromarray copies RGB data out of it
+        image = image.permute(1, 2, 0)
+        if self._host_buffer is None or self._host_buffer.shape != image.shape:
+            self._host_buffer = torch.empty(image.shape, dtype=torch.uint8, pin_memory=True)
+        self._host_buffer.copy_(image, non_blocking=True)
+        torch.cuda.current_stream().synchronize()
+        return Image.fromarray(self._host_buffer.numpy())
 
     def set_unet(self, unet_path: str):
         """
@@ -47,7 +57,12 @@ class SDXLPipeline:
         width: int = 1152,
         num_inference_steps: int = 12,
         seed: int = 44,
+        output_type: str = "pil",
     ):
+        # "pil" returns a PIL image, "pt" the CHW uint8 image as a CUDA tensor
+        if output_type not in ("pil", "pt"):
+            raise ValueError(f"Unsupported output_type {output_type!r}, expected 'pil' or 'pt'")
+
         with torch.no_grad():
             print("\n" + "="*50)
             print("--- Starting SDXL Pipeline (Monitored Run) ---")
@@ -173,8 +188,11 @@ class SDXLPipeline:
 
             # 7. Post-process image
             print("\n--- Post-processing Image ---")
-            image = self.image_processor.postprocess(image_np.detach().cpu(), output_type="pil")[0]
-            print(f"Post-processed image: {image}")
+            # Denormalize on the GPU; "pt" returns the CHW uint8 CUDA tensor without touching the host
+            image = utils._denormalize_to_uint8(image_np)[0]
+            if output_type == "pil":
+                image = self._to_pil(image)
+            print(f"Post-processed image: {image if output_type == 'pil' else image.shape}")
             print("--- Post-processing Complete ---")
 
             
@@ -195,6 +213,10 @@ if __name__ == "__main__":
     )
     pipeline = SDXLPipeline()
 
+    # Warmup run: pays CUDA context and TensorRT execution setup before the timed run
+    _ = pipeline(prompt)
+    torch.cuda.synchronize()
+
     # Monitored run with default (INT8) UNet
     print("\n--- Running Inference with INT8 UNet ---")
     start_time = time.time()
@@ -55,4 +55,8 @@ def _get_add_time_ids(original_size, crops_coords_top_left, target_size, dtype):
 
 def _clear_memory():
     print("--- In _clear_memory ---")
-    gc.collect() 
\ No newline at end of file
+    gc.collect()
+
+def _denormalize_to_uint8(image):
+    # VAE output in [-1, 1] -> uint8 in [0, 255], kept on the image's device
+    return ((image.float() / 2 + 0.5).clamp(0, 1) * 255).round().to(torch.uint8)
@@ -1,14 +1,17 @@
 #!/usr/bin/env python3
 import torch
+import torch.nn as nn
+from torch.nn.attention import SDPBackend, sdpa_kernel
 from diffusers import (
     StableDiffusionXLPipeline,
     UNet2DConditionModel,
     AutoencoderKL,
     EulerDiscreteScheduler,
 )
-from transformers import CLIPTokenizer, CLIPTextModel, CLIPTextModelWithProjection
+from transformers import CLIPTokenizerFast, CLIPTextModel, CLIPTextModelWithProjection
 from safetensors.torch import load_file
 from pathlib import Path
+import os
 import sys
 from PIL import Image
 import shutil
@@ -16,16 +19,54 @@ import time
 from tqdm import tqdm
 import numpy as np
 
+class ScaledUNet(nn.Module):
+    """
+    UNet with the Euler scheduler's input scaling folded into its forward pass,
+    so the compiled graph fuses the scale into the UNet's first kernels.
+    """
+    def __init__(self, unet: nn.Module):
+        super().__init__()
+        self.unet = unet
+
+    def forward(
+        self,
+        latents: torch.Tensor,
+        sigma: torch.Tensor,
+        t: torch.Tensor,
+        encoder_hidden_states: torch.Tensor,
+        added_cond_kwargs: dict,
+    ) -> torch.Tensor:
+        # Same expression as EulerDiscreteScheduler.scale_model_input
+        latent_model_input = latents / ((sigma**2 + 1) ** 0.5)
+        return self.unet(
+            latent_model_input,
+            t,
+            encoder_hidden_states=encoder_hidden_states,
+            cross_attention_kwargs=None,
+            added_cond_kwargs=added_cond_kwargs,
+            return_dict=False,
+        )[0]
+
 def main():
     """
     Generates an image with SDXL using an unfused UNet, a separate VAE, and a LoRA.
     The process is run manually to decode the UNet output with the VAE explicitly.
     """
-    with torch.no_grad():
+    # Expandable segments avoid fragmentation between the text-encoder, UNet and VAE stages;
+    # must be set before the first CUDA allocation
+    os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True,max_split_size_mb:512")
+
+    with torch.inference_mode():
         if not torch.cuda.is_available():
             print("Error: CUDA is not available. This script requires a GPU.")
             sys.exit(1)
 
+        # Fast-precision matmul/conv paths and cuDNN autotuning for the fixed-shape UNet
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+        torch.backends.cuda.matmul.allow_fp16_accumulation = True
+        torch.backends.cudnn.benchmark = True
+
         # --- Configuration ---
         base_dir = Path("/lab/model")
         device = "cuda"
@@ -48,33 +89,36 @@ def main():
         
         # Load VAE from its own directory
         print("Loading VAE...")
+        # Weights are streamed straight into GPU memory instead of staged on the CPU and copied with .to(device)
         vae = AutoencoderKL.from_pretrained(
             base_dir / "vae",
-            torch_dtype=dtype
+            torch_dtype=dtype,
+            low_cpu_mem_usage=True,
+            device_map={"": device},
         )
-        vae.to(device)
 
         # Load text encoders and tokenizers
         print("Loading text encoders and tokenizers...")
-        tokenizer = CLIPTokenizer.from_pretrained(str(base_dir), subfolder="tokenizer")
-        tokenizer_2 = CLIPTokenizer.from_pretrained(str(base_dir), subfolder="tokenizer_2")
+        tokenizer = CLIPTokenizerFast.from_pretrained(str(base_dir), subfolder="tokenizer")
+        tokenizer_2 = CLIPTokenizerFast.from_pretrained(str(base_dir), subfolder="tokenizer_2")
         text_encoder = CLIPTextModel.from_pretrained(
-            str(base_dir), subfolder="text_encoder", torch_dtype=dtype, use_safetensors=True
+            str(base_dir), subfolder="text_encoder", torch_dtype=dtype, use_safetensors=True,
+            low_cpu_mem_usage=True, device_map={"": device},
         )
-        text_encoder.to(device)
         text_encoder_2 = CLIPTextModelWithProjection.from_pretrained(
-            str(base_dir), subfolder="text_encoder_2", torch_dtype=dtype, use_safetensors=True
+            str(base_dir), subfolder="text_encoder_2", torch_dtype=dtype, use_safetensors=True,
+            low_cpu_mem_usage=True, device_map={"": device},
         )
-        text_encoder_2.to(device)
 
         # Load the unfused UNet weights
         print("Loading unfused UNet...")
         unet_dir = base_dir / "unet"
 
         unet = UNet2DConditionModel.from_pretrained(
-            str(unet_dir), torch_dtype=dtype, use_safetensors=True
+            str(unet_dir), torch_dtype=dtype, use_safetensors=True,
+            low_cpu_mem_usage=True, device_map={"": device},
         )
-        unet.to(device)
+        unet.to(memory_format=torch.channels_last)
         print("✓ Unfused UNet loaded.")
 
         # Create the scheduler
@@ -94,15 +138,26 @@ def main():
             unet=unet,
             scheduler=scheduler,
         )
-        pipe.enable_xformers_memory_efficient_attention()
-        pipe.enable_vae_tiling()
-        pipe.enable_vae_slicing()
+        # No xFormers: the UNet and VAE keep diffusers' default AttnProcessor2_0 (native SDPA), which traces
+        # cleanly under torch.compile. The UNet/VAE calls below restrict SDPA to the fused backends locally,
+        # so the CLIP encoders keep the math fallback
+        attn_backends = [SDPBackend.FLASH_ATTENTION, SDPBackend.EFFICIENT_ATTENTION]
+        # A single 104x152 latent decodes in one pass; tiling only pays off at very large resolutions
+        if height * width > 1536 * 1536:
+            pipe.enable_vae_tiling()
+
+        # Compile the scaled UNet: Inductor fuses kernels and CUDA graphs remove per-step launch overhead
+        torch._dynamo.config.cache_size_limit = 128
+        scaled_unet = torch.compile(ScaledUNet(pipe.unet), mode="reduce-overhead", fullgraph=True, backend="inductor")
+        # Compile the decoder submodule in place; vae.decode() keeps its diffusers forward hooks and calls into it
+        pipe.vae.decoder.compile(backend="inductor")
 
 
         # --- Manual Inference Process ---
         print("\n=== Starting Manual Inference ===")
         # 1. Encode prompts
         print("Encoding prompts...")
+        # cfg_scale is 1.0, so the negative prompt is never used; skip encoding it (negative outputs are None)
         (
             prompt_embeds,
             _,
@@ -112,8 +167,10 @@ def main():
             prompt,
             device=device,
             num_images_per_prompt=batch_size,
-            do_classifier_free_guidance=1
+            do_classifier_free_guidance=False,
         )
+        # Release text-encoder intermediates before the UNet stage
+        torch.cuda.empty_cache()
 
         # 2. Prepare latents
         print("Preparing latents...")
@@ -124,7 +181,9 @@ def main():
             dtype=dtype,
         )
         # Scale the initial noise by the scheduler's standard deviation
-        latents = latents * pipe.scheduler.init_noise_sigma
+        latents.mul_(pipe.scheduler.init_noise_sigma)
+        # Match the channels_last UNet so cuDNN picks NHWC tensor-core kernels without layout conversions
+        latents = latents.to(memory_format=torch.channels_last)
 
         # 3. Prepare timesteps from custom sigmas
         custom_sigmas_np = np.array([7.371844291687012, 4.116696357727051, 2.5109214782714844, 1.6236920356750488, 1.0760310888290405, 0.6983981132507324, 0.4022177457809448, 0.04131441190838814, 0.0])
@@ -136,18 +195,14 @@ def main():
         scheduler_sigmas = scheduler.sigmas.to(device=device, dtype=dtype)
 
         # For each of our custom sigmas, find the closest timestep in the scheduler's original list of timesteps
-        timesteps_list = []
-        for sigma in custom_sigmas[:-1]: # Exclude the last sigma (0.0) as it's the destination, not a step
-            idx = torch.argmin(torch.abs(scheduler_sigmas - sigma))
-            timesteps_list.append(scheduler.timesteps[idx])
-        
-        timesteps = torch.tensor(timesteps_list, device=device)
+        # in one broadcast argmin; the last sigma (0.0) is the destination, not a step
+        idxs = (scheduler_sigmas.unsqueeze(0) - custom_sigmas[:-1].unsqueeze(1)).abs().argmin(dim=1)
+        timesteps = scheduler.timesteps.to(device)[idxs]
         
         print(f"Using {num_inference_steps} inference steps.")
         print(f"Using custom sigmas: {custom_sigmas_np.tolist()}")
         print(f"Recovered timesteps: {timesteps.cpu().numpy().tolist()}")
 
-        exit()
         pipe.scheduler.set_timesteps(num_inference_steps, device=device)
         
         # Overwrite with our recovered timesteps and custom sigmas
@@ -156,37 +211,47 @@ def main():
         
         add_time_ids = pipe._get_add_time_ids((height, width), (0,0), (height, width), dtype, text_encoder_projection_dim=text_encoder_2.config.projection_dim).to(device)
         add_time_ids = add_time_ids.repeat(batch_size, 1)
+        # Added conditioning signals are built once; the UNet sees the same dict and tensors on every call
+        added_cond_kwargs = {"text_embeds": pooled_prompt_embeds.contiguous(), "time_ids": add_time_ids.contiguous()}
         
+        # Warm up the compiled UNet outside the timed loop: the first calls compile and record the CUDA graph.
+        # t and sigma stay 0-d tensors so guards do not specialize on their values
+        print("Warming up compiled UNet...")
+        with sdpa_kernel(attn_backends):
+            for _ in range(3):
+                torch.compiler.cudagraph_mark_step_begin()
+                scaled_unet(torch.randn_like(latents), custom_sigmas[0], timesteps[0], prompt_embeds, added_cond_kwargs)
+        torch.cuda.synchronize()
+
         # 4. Denoising loop
         print(f"Running denoising loop for {num_inference_steps} steps...")
+        # ScaledUNet applies scale_model_input itself; the scheduler's sigmas are custom_sigmas and its step index
+        # advances by one per step from 0, so custom_sigmas[i] is the sigma scheduler.step uses at step i
+        pipe.scheduler.is_scale_input_called = True
         start_time = time.time()
         for i, t in enumerate(tqdm(timesteps)):
             # No CFG for cfg_scale=1.0, so we don't duplicate inputs
-            latent_model_input = latents
-            
-            latent_model_input = pipe.scheduler.scale_model_input(latent_model_input, t)
-            
-            # Prepare added conditioning signals
-            added_cond_kwargs = {"text_embeds": pooled_prompt_embeds, "time_ids": add_time_ids}
+
+            # Each step replays the UNet's CUDA graph; marking the boundary lets the replay reuse the previous
+            # step's output memory, since noise_pred has been consumed by scheduler.step by then
+            torch.compiler.cudagraph_mark_step_begin()
 
             # Predict the noise residual
-            noise_pred = pipe.unet(
-                latent_model_input,
-                t,
-                encoder_hidden_states=prompt_embeds,
-                cross_attention_kwargs=None,
-                added_cond_kwargs=added_cond_kwargs,
-                return_dict=False,
-            )[0]
+            with sdpa_kernel(attn_backends):
+                noise_pred = scaled_unet(latents, custom_sigmas[i], t, prompt_embeds, added_cond_kwargs)
             
             # No guidance is applied since cfg_scale is 1.0
 
             # Compute the previous noisy sample x_t -> x_{t-1}
             latents = pipe.scheduler.step(noise_pred, t, latents, generator=generator, return_dict=False)[0]
         
+        # Kernels run asynchronously; wait for the last step before reading the clock
+        torch.cuda.synchronize()
         end_time = time.time()
         print(f"Denoising loop took: {end_time - start_time:.4f} seconds")
         print("✓ Denoising loop complete.")
+        # Release cached blocks from the UNet stage before the VAE decode
+        torch.cuda.empty_cache()
         
         # 5. Manually decode the latents with the VAE
         print("Decoding latents with VAE...")
@@ -200,9 +265,16 @@ def main():
         latents_for_vae = latents / pipe.vae.config.scaling_factor
         print(f"Latents to VAE - Shape: {latents_for_vae.shape}, DType: {latents_for_vae.dtype}")
         
+        # Warm up the compiled decoder so compilation stays out of the timed decode
+        with sdpa_kernel(attn_backends):
+            pipe.vae.decode(torch.randn_like(latents_for_vae), return_dict=False)
+        torch.cuda.synchronize()
+
         # The VAE scales the latents internally
         start_time = time.time()
-        image = pipe.vae.decode(latents_for_vae, return_dict=False)[0]
+        with sdpa_kernel(attn_backends):
+            image = pipe.vae.decode(latents_for_vae, return_dict=False)[0]
+        torch.cuda.synchronize()
         end_time = time.time()
         print(f"VAE decoding took: {end_time - start_time:.4f} seconds")
         
@@ -215,13 +287,15 @@ def main():
         
         # 7. Save the images
         script_name = Path(__file__).stem
-        i = 0
+        # Continue numbering after the highest existing index with a single directory scan
+        existing = [
+            int(p.stem.split("__")[-1])
+            for p in Path(".").glob(f"{script_name}__*.png")
+            if p.stem.split("__")[-1].isdigit()
+        ]
+        i = max(existing, default=-1) + 1
         for image in images:
-            while True:
-                output_path = f"{script_name}__{i:04d}.png"
-                if not Path(output_path).exists():
-                    break
-                i += 1
+            output_path = f"{script_name}__{i:04d}.png"
             image.save(output_path)
             print(f"✓ Image saved to: {output_path}")
             i += 1
@@ -9,9 +9,11 @@ pipe = StableDiffusionXLPipeline.from_single_file(
     torch_dtype=torch.float16,
     use_safetensors=True,
 )
+# Move to the GPU first so the LoRA fusion runs as GPU matmuls instead of fp16 math on the CPU
+pipe.to("cuda")
 pipe.load_lora_weights("/lab/dmd2_sdxl_4step_lora_fp16.safetensors")
 pipe.fuse_lora(lora_scale=1.0)
-pipe.to("cuda")
+pipe.unet.to(memory_format=torch.channels_last)
 pipe.enable_xformers_memory_efficient_attention()
 
 pipe.scheduler = EulerAncestralDiscreteScheduler.from_config(
@@ -263,11 +263,11 @@ def main():
         latent_height = 120
         latent_width = 120
         
-        sample = torch.randn(batch_size, 4, latent_height, latent_width, dtype=torch.float16).to("cuda")
-        timestep = torch.tensor(999, dtype=torch.float16).to("cuda")
-        encoder_hidden_states = torch.randn(batch_size, 77, 2048, dtype=torch.float16).to("cuda")
-        text_embeds = torch.randn(batch_size, 1280, dtype=torch.float16).to("cuda")
-        time_ids = torch.randn(batch_size, 6, dtype=torch.float16).to("cuda")
+        sample = torch.empty(batch_size, 4, latent_height, latent_width, dtype=torch.float16, device="cuda").normal_()
+        timestep = torch.tensor(999, dtype=torch.float16, device="cuda")
+        encoder_hidden_states = torch.empty(batch_size, 77, 2048, dtype=torch.float16, device="cuda").normal_()
+        text_embeds = torch.empty(batch_size, 1280, dtype=torch.float16, device="cuda").normal_()
+        time_ids = torch.empty(batch_size, 6, dtype=torch.float16, device="cuda").normal_()
         
         unet_wrapper = UnetWrapper(unet)
         
@@ -283,11 +283,20 @@ def main():
         # Export to a temporary file first
         temp_onnx_path = onnx_output_path + ".temp"
         
+        # Run the restored INT8 UNet in the same no_grad context as the export, so a checkpoint that cannot
+        # run fails before the slow trace and one-time CUDA/cuBLAS setup is done before it
+        print("Warming up UNet...")
+        model_args = (sample, timestep, encoder_hidden_states, text_embeds, time_ids)
+        with torch.no_grad():
+            for _ in range(2):
+                unet_wrapper(*model_args)
+        torch.cuda.synchronize()
+
         print("Exporting to ONNX...")
         with torch.no_grad():
             torch.onnx.export(
                 unet_wrapper,
-                (sample, timestep, encoder_hidden_states, text_embeds, time_ids),
+                model_args,
                 temp_onnx_path,
                 input_names=input_names,
                 output_names=output_names,
@@ -361,6 +370,15 @@ def main():
             # Fallback: save without external data consolidation
             print("Trying fallback save...")
             onnx.save(model, onnx_output_path)
+
+        # Bake symbolic shapes into the graph for the ORT/TensorRT engine build; the path-based
+        # variant works on the >2GB external-data model without loading it into one proto
+        print("Running ONNX shape inference...")
+        try:
+            onnx.shape_inference.infer_shapes_path(onnx_output_path, data_prop=True)
+            print("Shape inference complete")
+        except Exception as e:
+            print(f"Shape inference failed: {e}, keeping model without inferred shapes")
         
         # Clean up temporary files
         print("Cleaning up temporary and scattered files...")
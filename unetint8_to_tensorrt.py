@@ -239,11 +239,11 @@ def main():
         latent_height = 120
         latent_width = 120
         
-        sample = torch.randn(batch_size, 4, latent_height, latent_width, dtype=torch.float16).to("cuda")
-        timestep = torch.tensor(999, dtype=torch.float16).to("cuda")
-        encoder_hidden_states = torch.randn(batch_size, 77, 2048, dtype=torch.float16).to("cuda")
-        text_embeds = torch.randn(batch_size, 1280, dtype=torch.float16).to("cuda")
-        time_ids = torch.randn(batch_size, 6, dtype=torch.float16).to("cuda")
+        sample = torch.empty(batch_size, 4, latent_height, latent_width, dtype=torch.float16, device="cuda").normal_()
+        timestep = torch.tensor(999, dtype=torch.float16, device="cuda")
+        encoder_hidden_states = torch.empty(batch_size, 77, 2048, dtype=torch.float16, device="cuda").normal_()
+        text_embeds = torch.empty(batch_size, 1280, dtype=torch.float16, device="cuda").normal_()
+        time_ids = torch.empty(batch_size, 6, dtype=torch.float16, device="cuda").normal_()
         
         unet_wrapper = UnetWrapper(unet)
         
@@ -256,10 +256,19 @@ def main():
             "time_ids": {0: "batch_size"},
         }
         
+        # Run the restored INT8 UNet in the same no_grad context as the export, so a checkpoint that cannot
+        # run fails before the slow trace and one-time CUDA/cuBLAS setup is done before it
+        print("Warming up UNet...")
+        model_args = (sample, timestep, encoder_hidden_states, text_embeds, time_ids)
+        with torch.no_grad():
+            for _ in range(2):
+                unet_wrapper(*model_args)
+        torch.cuda.synchronize()
+
         with torch.no_grad():
             torch.onnx.export(
                 unet_wrapper,
-                (sample, timestep, encoder_hidden_states, text_embeds, time_ids),
+                model_args,
                 onnx_output_path,
                 input_names=input_names,
                 output_names=output_names,